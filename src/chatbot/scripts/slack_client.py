@@ -53,6 +53,9 @@ def format_trace(traces):
 
 class HRSlackBot(object):
 
+    GOOD_RATINGS = frozenset([':+1:', ':slightly_smiling_face:', ':)', 'gd'])
+    BAD_RATINGS = frozenset([':-1:', ':disappointed:', ':(', 'bd'])
+
     def __init__(self, host, port, botname, **kwargs):
         self.sc = SlackClient(SLACKBOT_API_TOKEN)
         self.sc.rtm_connect()
@@ -63,6 +66,7 @@ class HRSlackBot(object):
         self.icon_url = 'https://avatars.slack-edge.com/2016-05-30/46725216032_4983112db797f420c0b5_48.jpg'
         self.session_manager = SessionManager()
         self.weights = kwargs.get('weights')
+        self._user_cache = {}
 
     def send_message(self, channel, attachments):
         self.sc.api_call(
@@ -88,24 +92,41 @@ class HRSlackBot(object):
         logger.info(msg)
         self.send_message(channel, attachments)
 
+    def _get_name(self, user_id):
+        """
+        Returns (ok, name) for the Slack user. ok is False if the user info
+        can't be fetched. Successful lookups are cached, including users
+        whose profile has neither first name nor email (name is None).
+        """
+        if user_id in self._user_cache:
+            return True, self._user_cache[user_id]
+        usr_obj = self.sc.api_call(
+            'users.info', token=SLACKTEST_TOKEN, user=user_id)
+        if not usr_obj['ok']:
+            return False, None
+        profile = usr_obj['user']['profile']
+        name = profile.get('first_name') or profile.get('email')
+        self._user_cache[user_id] = name
+        return True, name
+
     def run(self):
         while True:
-            time.sleep(0.2)
             messages = self.sc.rtm_read()
             if not messages:
+                time.sleep(0.1)
                 continue
             for message in messages:
                 if message['type'] != u'message':
                     continue
                 if message.get('subtype') == u'bot_message':
                     continue
-                usr_obj = self.sc.api_call(
-                    'users.info', token=SLACKTEST_TOKEN, user=message['user'])
-                if not usr_obj['ok']:
-                    continue
-                profile = usr_obj['user']['profile']
-                name = profile.get('first_name') or profile.get('email')
+                # Drop what can't be answered before asking Slack who sent it
                 question = message.get('text')
+                if not question or 'user' not in message:
+                    continue
+                ok, name = self._get_name(message['user'])
+                if not ok:
+                    continue
                 channel = message.get('channel')
 
                 sid = self.session_manager.get_sid(name, self.botname)
@@ -132,7 +153,7 @@ class HRSlackBot(object):
                         continue
 
                 logger.info("Question {}".format(question))
-                if question in [':+1:', ':slightly_smiling_face:', ':)', 'gd']:
+                if question in self.GOOD_RATINGS:
                     ret, _ = client._rate('good')
                     if ret:
                         logger.info("Rate good")
@@ -149,7 +170,7 @@ class HRSlackBot(object):
                     }]
                     self.send_message(channel, attachments)
                     continue
-                if question in [':-1:', ':disappointed:', ':(', 'bd']:
+                if question in self.BAD_RATINGS:
                     ret, _ = client._rate('bad')
                     if ret:
                         logger.info("Rate bad")
@@ -1,5 +1,11 @@
 import cmd
 import requests
+from requests.adapters import HTTPAdapter
+try:
+    from requests.packages.urllib3.util.retry import Retry
+except ImportError:
+    # urllib3 older than 1.8, as bundled with older distro requests
+    Retry = None
 import json
 import os
 import re
@@ -33,6 +39,8 @@ ERRORS = {
 class Client(cmd.Cmd, object):
 
     VERSION = 'v1.1'
+    # Seconds to wait for the chatbot server to connect or send data
+    HTTP_TIMEOUT = 30
 
     def __init__(self, key, response_listener=None, username=None, botname='sophia',
             host='localhost', port='8001', test=False,
@@ -68,6 +76,18 @@ class Client(cmd.Cmd, object):
         self.timer = None
         self.timeout = None
         self.weights = None
+        # Keep-alive connections to the chatbot server, shared by all requests.
+        # Only failed connects are retried: a request that reached the server
+        # (e.g. a question to /chat) must not be sent again.
+        self.http = requests.Session()
+        if Retry is not None:
+            max_retries = Retry(total=3, connect=3, read=0, backoff_factor=0.5)
+        else:
+            max_retries = 0
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8,
+            max_retries=max_retries)
+        self.http.mount('http://', adapter)
+        self.http.mount('https://', adapter)
         if self.ping():
             self.do_conn()
         else:
@@ -103,8 +123,8 @@ class Client(cmd.Cmd, object):
         }
         response = None
         try:
-            response = requests.get(
-                '{}/start_session'.format(self.root_url), params=params)
+            response = self.http.get(
+                '{}/start_session'.format(self.root_url), params=params, timeout=self.HTTP_TIMEOUT)
         except Exception as ex:
             self.stdout.write('{}\n'.format(ex))
         if response is None:
@@ -136,10 +156,17 @@ class Client(cmd.Cmd, object):
         headers = {
             'X-Request-ID': request_id or str(uuid.uuid1())
         }
-        r = requests.get('{}/chat'.format(self.root_url), params=params, headers=headers)
-        ret = r.json().get('ret')
+        r = self.http.get('{}/chat'.format(self.root_url), params=params, headers=headers,
+            timeout=self.HTTP_TIMEOUT)
         if r.status_code != 200:
             self.stdout.write("Request error: {}\n".format(r.status_code))
+            raise Exception("Request error: {}".format(r.status_code))
+        try:
+            data = r.json()
+        except ValueError:
+            logger.error("Invalid response {}".format(r.text))
+            raise
+        ret = data.get('ret')
 
         if ret != 0:
             self.stdout.write("QA error: error code {}, botname {}, question {}, lang {}\n".format(
@@ -147,7 +174,7 @@ class Client(cmd.Cmd, object):
             raise Exception("QA error: {}({})".format(ERRORS.get(ret, 'Unknown'), ret))
 
         response = {'text': '', 'emotion': '', 'botid': '', 'botname': ''}
-        response.update(r.json().get('response'))
+        response.update(data.get('response'))
 
         if question == '[loopback]':
             self.timer = threading.Timer(self.timeout, self.ask, (question, ))
@@ -160,15 +187,15 @@ class Client(cmd.Cmd, object):
 
     def list_chatbot(self):
         params = {'Auth': self.key, 'lang': self.lang, 'session': self.session}
-        r = requests.get(
-            '{}/chatbots'.format(self.root_url), params=params)
+        r = self.http.get(
+            '{}/chatbots'.format(self.root_url), params=params, timeout=self.HTTP_TIMEOUT)
         chatbots = r.json().get('response')
         return chatbots
 
     def list_chatbot_names(self):
         params = {'Auth': self.key, 'lang': self.lang, 'session': self.session}
-        r = requests.get(
-            '{}/bot_names'.format(self.root_url), params=params)
+        r = self.http.get(
+            '{}/bot_names'.format(self.root_url), params=params, timeout=self.HTTP_TIMEOUT)
         names = r.json().get('response')
         return names
 
@@ -319,10 +346,11 @@ For example, port 8001
                 "session": "{}".format(self.session),
                 'Auth': self.key
             }
-            r = requests.get(
-                '{}/reset_session'.format(self.root_url), params=params)
-            ret = r.json().get('ret')
-            response = r.json().get('response')
+            r = self.http.get(
+                '{}/reset_session'.format(self.root_url), params=params, timeout=self.HTTP_TIMEOUT)
+            data = r.json()
+            ret = data.get('ret')
+            response = data.get('response')
             self.stdout.write(response)
             self.stdout.write('\n')
         except Exception as ex:
@@ -346,10 +374,11 @@ For example, port 8001
                 "lang": self.lang,
                 "session": self.session
             }
-            r = requests.get(
-                '{}/set_weights'.format(self.root_url), params=params)
-            ret = r.json().get('ret')
-            response = r.json().get('response')
+            r = self.http.get(
+                '{}/set_weights'.format(self.root_url), params=params, timeout=self.HTTP_TIMEOUT)
+            data = r.json()
+            ret = data.get('ret')
+            response = data.get('response')
             self.stdout.write(response)
             self.stdout.write('\n')
             if not ret:
@@ -410,11 +439,12 @@ Reset the weight of tiers to their defaults.
             "lang": 'en'
         }
         try:
-            r = requests.post(
+            r = self.http.post(
                 '{}/upload_character'.format(self.root_url),
-                files=files, data=params)
-            ret = r.json().get('ret')
-            response = r.json().get('response')
+                files=files, data=params, timeout=self.HTTP_TIMEOUT)
+            data = r.json()
+            ret = data.get('ret')
+            response = data.get('response')
             self.stdout.write(response)
             self.stdout.write('\n')
         except Exception:
@@ -430,7 +460,9 @@ Syntax: upload package
 
     def ping(self):
         try:
-            r = requests.get('{}/ping'.format(self.root_url))
+            # Not through self.http, so a dead server fails at once
+            # instead of waiting out the connect retries.
+            r = requests.get('{}/ping'.format(self.root_url), timeout=self.HTTP_TIMEOUT)
             response = r.json().get('response')
             if response == 'pong':
                 return True
@@ -469,9 +501,17 @@ Syntax: upload package
             "index": -1,
             "Auth": self.key
         }
-        r = requests.get('{}/rate'.format(self.root_url), params=params)
-        ret = r.json().get('ret')
-        response = r.json().get('response')
+        r = self.http.get('{}/rate'.format(self.root_url), params=params, timeout=self.HTTP_TIMEOUT)
+        if r.status_code != 200:
+            logger.error("Request error: {}".format(r.status_code))
+            return False, None
+        try:
+            data = r.json()
+        except ValueError:
+            logger.error("Invalid response {}".format(r.text))
+            return False, None
+        ret = data.get('ret')
+        response = data.get('response')
         return ret, response
 
     def do_gd(self, line):
@@ -499,8 +539,8 @@ Syntax: upload package
             "session": self.session,
             "Auth": self.key
         }
-        r = requests.get(
-            '{}/session_history'.format(self.root_url), params=params)
+        r = self.http.get(
+            '{}/session_history'.format(self.root_url), params=params, timeout=self.HTTP_TIMEOUT)
         if r.status_code == 200:
             fname = '{}.csv'.format(self.session)
             with open(fname, 'w') as f:
@@ -529,9 +569,11 @@ Syntax: upload package
             "Auth": self.key,
             "lookback": lookback
         }
-        r = requests.get('{}/stats'.format(self.root_url), params=params)
-        ret = r.json().get('ret')
-        response = r.json().get('response')
+        r = self.http.get('{}/stats'.format(self.root_url), params=params,
+            timeout=self.HTTP_TIMEOUT)
+        data = r.json()
+        ret = data.get('ret')
+        response = data.get('response')
         if ret:
             self.stdout.write(
                 'Customers satisfaction degree {customers_satisfaction_degree:.4f}\n'
@@ -574,8 +616,8 @@ Syntax: upload package
         params = {
             "Auth": self.key
         }
-        r = requests.get(
-            '{}/sessions'.format(self.root_url), params=params)
+        r = self.http.get(
+            '{}/sessions'.format(self.root_url), params=params, timeout=self.HTTP_TIMEOUT)
         sessions = r.json().get('response')
         if sessions:
             self.stdout.write('sessions: {}\n'.format('\n'.join(sessions)))
@@ -610,8 +652,8 @@ Syntax: upload package
             "context": line,
             "session": self.session
         }
-        r = requests.get(
-            '{}/set_context'.format(self.root_url), params=params)
+        r = self.http.get(
+            '{}/set_context'.format(self.root_url), params=params, timeout=self.HTTP_TIMEOUT)
         response = r.json().get('response')
         self.stdout.write(response)
         self.stdout.write('\n')
@@ -632,8 +674,8 @@ Syntax: sc key=value,key2=value2,...
             "keys": line,
             "session": self.session
         }
-        r = requests.get(
-            '{}/remove_context'.format(self.root_url), params=params)
+        r = self.http.get(
+            '{}/remove_context'.format(self.root_url), params=params, timeout=self.HTTP_TIMEOUT)
         response = r.json().get('response')
         self.stdout.write(response)
         self.stdout.write('\n')
@@ -654,8 +696,8 @@ Syntax: rc key,key2,key3,...
             "Auth": self.key,
             "session": self.session
         }
-        response = requests.get(
-            '{}/get_context'.format(self.root_url), params=params)
+        response = self.http.get(
+            '{}/get_context'.format(self.root_url), params=params, timeout=self.HTTP_TIMEOUT)
         return response.json().get('response')
 
     @retry(1)
@@ -675,10 +717,11 @@ Syntax: rc key,key2,key3,...
             "session": self.session,
             "message": line
         }
-        r = requests.get(
-            '{}/said'.format(self.root_url), params=params)
-        ret = r.json().get('ret')
-        response = r.json().get('response')
+        r = self.http.get(
+            '{}/said'.format(self.root_url), params=params, timeout=self.HTTP_TIMEOUT)
+        data = r.json()
+        ret = data.get('ret')
+        response = data.get('response')
         self.stdout.write(response)
         self.stdout.write('\n')
 
@@ -690,10 +733,11 @@ Syntax: rc key,key2,key3,...
             "Auth": self.key,
         }
         params.update(kwargs)
-        r = requests.get(
-            '{}/update_config'.format(self.root_url), params=params)
-        ret = r.json().get('ret')
-        response = r.json().get('response')
+        r = self.http.get(
+            '{}/update_config'.format(self.root_url), params=params, timeout=self.HTTP_TIMEOUT)
+        data = r.json()
+        ret = data.get('ret')
+        response = data.get('response')
         logger.info(response)
 
 if __name__ == '__main__':
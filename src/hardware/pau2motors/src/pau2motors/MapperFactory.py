@@ -19,6 +19,7 @@
 
 import copy
 import math
+import numpy as np
 import NeckKinematics
 import NeckVertical
 from scipy.interpolate import interp1d
@@ -37,6 +38,14 @@ class MapperBase:
   def map(self, val):
     raise NotImplementedError
 
+  def map_batch(self, arr):
+    """
+    Map every value in the array 'arr'.  Subclasses that can operate on
+    whole arrays at once should override this; the default falls back to
+    calling 'map' once per value.
+    """
+    return np.array([self.map(val) for val in arr])
+
   def __init__(self, args, motor_entry):
     """
     On construction, mapper classes are passed an 'args' object and a
@@ -77,14 +86,36 @@ class Composite(MapperBase):
 
   would cause the quaternion2euler mapper function to be applied first,
   followed by the linear mapper.
+
+  The last input and its output are remembered, so that a motor that
+  keeps receiving the same value (e.g. while idling in a pose) doesn't
+  run through the whole chain again.
   """
   def map(self, val):
+    if isinstance(val, np.ndarray):
+      return self._map_chain(val)
+    # The entry is read and replaced as one tuple, so that a concurrent
+    # caller never pairs one input with another input's output.
+    last_in, last_out = self._last
+    if val is last_in or val == last_in:
+      return last_out
+    out = self._map_chain(val)
+    self._last = (val, out)
+    return out
+
+  def _map_chain(self, val):
     for mapper_instance in self.mapper_list:
       val = mapper_instance.map(val)
     return val
 
+  def map_batch(self, arr):
+    for mapper_instance in self.mapper_list:
+      arr = mapper_instance.map_batch(arr)
+    return arr
+
   def __init__(self, mapper_list):
-    self.mapper_list = mapper_list
+    self.mapper_list = tuple(mapper_list)
+    self._last = (None, None)
 
 # --------------------------------------------------------------
 
@@ -113,20 +144,33 @@ class Linear(MapperBase):
   """
 
   def map(self, val):
-    return (val + self.pretranslate) * self.scale + self.posttranslate
+    # Works for scalars and numpy arrays alike.
+    return val * self._scale + self._offset
+
+  def map_batch(self, arr):
+    return np.asarray(arr) * self._scale + self._offset
 
   def __init__(self, args, motor_entry):
-    if args.has_key('scale') and args.has_key('translate'):
+    if 'scale' in args and 'translate' in args:
       self.pretranslate = 0
       self.scale = args['scale']
       self.posttranslate = args['translate']
 
-    elif args.has_key('min') and args.has_key('max'):
+    elif 'min' in args and 'max' in args:
       # Map the given 'min' and 'max' to the motor's 'min' and 'max'
       self.pretranslate = -args['min']
       self.scale = (motor_entry['max']-motor_entry['min'])/(args['max']-args['min'])
       self.posttranslate = motor_entry['min']
 
+    self.pretranslate = float(self.pretranslate)
+    self.scale = float(self.scale)
+    self.posttranslate = float(self.posttranslate)
+
+    # (val + pretranslate) * scale + posttranslate, folded into a single
+    # multiply-add.
+    self._scale = self.scale
+    self._offset = self.pretranslate * self.scale + self.posttranslate
+
 # --------------------------------------------------------------
 
 class WeightedSum(MapperBase):
@@ -145,33 +189,37 @@ class WeightedSum(MapperBase):
               - {min: 0, max: 0.6, imax: 1}
   """
 
-  @staticmethod
-  def _saturated(val, interval):
-    return min(max(val, min(interval["min"],interval["max"])), max(interval["min"],interval["max"]))
-
   def map(self, vals):
+    # Saturate every term to its own min-max range, then rescale and sum.
+    # zip() ignores values or terms beyond the shorter of the two.
     return sum(
-      map(
-        lambda (val, translate, scale, term):
-          (self._saturated(val, term) + translate) * scale,
-        zip(vals, self.pretranslations, self.scalefactors, self.termargs)
-      )
+      (min(max(val, lo), hi) + translate) * scale
+      for val, (lo, hi, translate, scale) in zip(vals, self._terms)
     ) + self.posttranslate
 
   def __init__(self, args, motor_entry):
     range_motors = motor_entry["max"] - motor_entry["min"]
 
     self.posttranslate = args["imin"] * range_motors + motor_entry["min"]
-    self.pretranslations = map(
+    self.pretranslations = tuple(map(
       lambda term: -term["min"],
       args["terms"]
-    )
-    self.scalefactors = map(
+    ))
+    self.scalefactors = tuple(map(
       lambda term:
         (term["imax"]-args["imin"])/(term["max"]-term["min"])*range_motors,
       args["terms"]
+    ))
+    self.termargs = tuple(args["terms"])
+
+    # Per-term (lo, hi, pretranslation, scale), with the saturation bounds
+    # ordered once here instead of on every call.
+    self._terms = tuple(
+      (min(term["min"], term["max"]), max(term["min"], term["max"]),
+       translate, scale)
+      for term, translate, scale
+      in zip(self.termargs, self.pretranslations, self.scalefactors)
     )
-    self.termargs = args["terms"]
 
 # --------------------------------------------------------------
 
@@ -201,20 +249,16 @@ class InterpSum(MapperBase):
             where result would be converted to angle
     """
 
-    @staticmethod
-    def _saturated(val, interval):
-        # Returns value if value is within min max of the input, and closest extreme otherwise
-        return min(max(val, min(interval["x0"], interval["xmax"])), max(interval["x0"], interval["xmax"]))
-
-
     def map(self, vals):
-        return (sum(
-            map(
-                lambda (val, function, term):
-                    function(self._saturated(val, term))-self.y0,
-                zip(vals, self.functions, self.termargs)
-            )
-        ) + self.y0) * self.range + self.motor_min
+        # Inputs outside a term's x range are clamped to its closest extreme.
+        # Only terms that got a value count, so y0 is subtracted per term
+        # summed rather than per term configured.
+        total = 0.0
+        n = 0
+        for val, function, lo, hi in zip(vals, self.functions, self._lo, self._hi):
+            total += function(min(max(val, lo), hi))
+            n += 1
+        return (total - n * self.y0) * self.range + self._offset
 
 
     def __init__(self, args, motor_entry):
@@ -224,8 +268,8 @@ class InterpSum(MapperBase):
         # Neutral position
         self.y0 = args['y0']
         # Create interpolation functions:
-        self.functions = []
-        self.termargs = []
+        functions = []
+        termargs = []
         for term in args["terms"]:
             # Neutral point
             ax = [term['x0']]
@@ -241,50 +285,141 @@ class InterpSum(MapperBase):
             elif len(ax) == 3:
                 method = 'quadratic'
             term["xmax"] = ax[-1]
-            self.functions.append(interp1d(ax,ay, method))
-            self.termargs.append(term)
+            functions.append(interp1d(ax,ay, method))
+            termargs.append(term)
+        self.functions = tuple(functions)
+        self.termargs = tuple(termargs)
+        # Input range of every term, ordered so that lo <= hi
+        self._lo = tuple(min(term["x0"], term["xmax"]) for term in self.termargs)
+        self._hi = tuple(max(term["x0"], term["xmax"]) for term in self.termargs)
+        # The y0 added back once, folded together with the motor offset.
+        self._offset = self.y0 * self.range + self.motor_min
+
+# Converts a quaternion to three rotation angles about the extrinsic axes
+# 'seq' = (i, j, k), numbered x=1, y=2, z=3, i.e. R = R_k R_j R_i. Returns
+# the angles in that same order.  Any of the twelve sequences is handled,
+# Tate-Bryan (i != k) as well as proper Euler (i == k), by the direct
+# method of Bernardes & Viollet, "Quaternion to Euler angles conversion: A
+# direct, general and computationally efficient method", PLoS ONE 17(11),
+# 2022: permute the quaternion components to (a, b, c, d) according to the
+# sequence, then read the angles off with two atan2 calls and one asin/acos.
+#
+# The middle angle assumes a unit quaternion; the outer two angles do not
+# depend on its norm.
+#
+# In gimbal lock (middle angle at +-pi/2 for Tate-Bryan, 0 or pi for proper
+# Euler) only the sum or difference of the outer angles is determined.  As
+# in the paper, the third angle is then set to 0 and the whole rotation is
+# put into the first one.  (The single-axis _yzx_* formulas below return 0
+# for both instead.)  Lock is detected when one of the (a, b), (c, d) pairs
+# is within about 1e-7 rad of vanishing relative to the other.
+_GIMBAL_LOCK_TOL = 2.5e-15
+
+def _quat_to_euler(w, x, y, z, seq,
+                   _atan2=math.atan2, _asin=math.asin, _acos=math.acos,
+                   _pi=math.pi, _tol=_GIMBAL_LOCK_TOL) :
+    # The math functions are bound as default arguments so that they are
+    # local lookups rather than global + attribute lookups on every call.
+    i, j, k = seq
+    q = (w, x, y, z)
+    proper = i == k
+    if proper:
+        k = 6 - i - j
+    eps = (i - j) * (j - k) * (k - i) // 2
+
+    if proper:
+        a, b, c, d = w, q[i], q[j], q[k] * eps
+    else:
+        a, b, c, d = w - q[j], q[i] + q[k] * eps, q[j] + w, q[k] * eps - q[i]
+
+    aa_bb = a * a + b * b
+    cc_dd = c * c + d * d
+    half_sum = _atan2(b, a)
+    half_diff = _atan2(d, c)
+
+    # Clamped, as rounding can push a locked quaternion just past +-1.
+    if proper:
+        theta2 = _acos(min(max(aa_bb - cc_dd, -1.0), 1.0))
+    else:
+        theta2 = _asin(min(max(0.5 * (cc_dd - aa_bb), -1.0), 1.0))
+
+    if cc_dd <= _tol * aa_bb:
+        theta1 = 2 * half_sum
+        theta3 = 0.0
+    elif aa_bb <= _tol * cc_dd:
+        theta1 = -2 * half_diff
+        theta3 = 0.0
+    else:
+        theta1 = half_sum - half_diff
+        theta3 = half_sum + half_diff
+        if not proper:
+            theta3 = eps * theta3
+
+    if _pi < theta1:
+        theta1 -= 2 * _pi
+    elif theta1 < -_pi:
+        theta1 += 2 * _pi
+    if _pi < theta3:
+        theta3 -= 2 * _pi
+    elif theta3 < -_pi:
+        theta3 += 2 * _pi
+    return (theta1, theta2, theta3)
+
+# Single-axis shortcuts for the default (Tate-Bryan YZX) case, which is what
+# the shipped configs use: a motor needs only one angle, and computing it
+# directly costs one transcendental instead of _quat_to_euler's three.  They
+# assume a unit quaternion, and _yzx_z raises ValueError if it is far enough
+# off that the asin argument leaves [-1, 1].
+def _yzx_x(q, _atan2=math.atan2) :
+    w = q.w; x = q.x; y = q.y; z = q.z
+    return _atan2(-2 * (y * z - w * x), w*w + y*y - z*z - x*x)
+
+def _yzx_z(q, _asin=math.asin) :
+    return _asin(2 * (q.y * q.x + q.w * q.z))
+
+def _yzx_y(q, _atan2=math.atan2) :
+    w = q.w; x = q.x; y = q.y; z = q.z
+    return _atan2(-2 * (z * x - w * y), w*w - y*y - z*z + x*x)
 
 class Quaternion2EulerYZX(MapperBase):
+  """
+  Converts a quaternion to intrinsic Y-Z-X (or extrinsic X-Z-Y) rotations
+  in that order. So if X axis is the line of sight, Y - vertical and Z -
+  horizontal axes, Y, Z and X rotations will represent Yaw, Pitch and Roll
+  respectively.  Properly speaking, these are not Euler angles, but
+  Tate-Bryan angles.  The 'axis' argument selects which one is returned:
 
-  def __init__(self, args, motor_entry):
+          function:
+            - name: quaternion2euler
+              axis: z
 
-    # These functions convert a quaternion to intrinsic Y-Z-X (or extrinsic
-    # X-Z-Y) rotations in that order. So if X axis is the line of sight, Y -
-    # vertical and Z - horizontal axes, Y, Z and X rotations will represent
-    # Yaw, Pitch and Roll respectively. For a different rotation order, swap
-    # q.x, q.y, q.z variables and 'x', 'y', 'z' keys.
-    #
-    # Properly speaking, these are not Euler angles, but Tate-Bryan angles.
-    #
-    # Note: Kudos to anyone who manages to put this swapping mechanism into
-    # code, which also builds functions to compute only one of the rotations
-    # like below. (it's harder than it looks)
-    def tate_z(q) :
-        z = math.asin(2 * (q.y * q.x + q.w * q.z))
-        return z
-
-    def tate_y(q) :
-        y = math.atan2(
-            -2 * (q.z * q.x - q.w * q.y),
-            q.w**2 - q.y**2 - q.z**2 + q.x**2
-          )
-        # print "tate y=", y
-        return y
-
-    def tate_x(q) :
-        x = math.atan2(
-            -2 *(q.y * q.z - q.w * q.x),
-            q.w**2 + q.y**2 - q.z**2 - q.x**2
-          )
-        # print "tate x=", x
-        return x
-
-    funcsByAxis = {
-      'y': lambda q : tate_y(q),
-      'z': lambda q : tate_z(q),
-      'x': lambda q : tate_x(q)
-    }
-    self.map = funcsByAxis[args['axis'].lower()]
+  An optional 'sequence' argument selects a different rotation order, given
+  as the extrinsic axes in the order they are applied, e.g. 'zyz' for proper
+  Euler angles.  The default is 'xzy'.  Since an axis appears twice in a
+  proper Euler sequence, 'index' (0, 1 or 2) can be given instead of 'axis'
+  to pick the angle by position:
+
+          function:
+            - name: quaternion2euler
+              sequence: zyz
+              index: 2
+  """
+
+  _yzx_funcs = {'x': _yzx_x, 'y': _yzx_y, 'z': _yzx_z}
+  _axis_numbers = {'x': 1, 'y': 2, 'z': 3}
+
+  def __init__(self, args, motor_entry):
+    sequence = args.get('sequence', 'xzy').lower()
+    if 'index' in args:
+      which = args['index']
+    else:
+      which = sequence.index(args['axis'].lower())
+
+    if sequence == 'xzy':
+      self.map = self._yzx_funcs[sequence[which]]
+    else:
+      seq = tuple(self._axis_numbers[a] for a in sequence)
+      self.map = lambda q: _quat_to_euler(q.w, q.x, q.y, q.z, seq)[which]
 
 # --------------------------------------------------------------
 #
@@ -370,13 +505,16 @@ def quat_to_asa(q) :
 def quat_fraction(q, frac) :
 
     # print "Quaternions: %7f" %q.w, "%10.7f" % q.x, "%10.7f" % q.y, "%10.7f" % q.z
-    e = q.x*q.x + q.y*q.y + q.z*q.z
+    x = q.x
+    y = q.y
+    z = q.z
+    e = x*x + y*y + z*z
     # one = q.w*q.w + e
     e = math.sqrt(e)
     # nex, ney, nez form a normalized unit vector.
-    nex = q.x / e
-    ney = q.y / e
-    nez = q.z / e
+    nex = x / e
+    ney = y / e
+    nez = z / e
 
     # alpha is the amount of rotation around the unit vector...
     alpha = 2 * math.asin (e)
@@ -408,7 +546,6 @@ class Quaternion2Upper(MapperBase):
   def __init__(self, args, motor_entry):
 
     self.hijoint = NeckKinematics.upper_neck()
-    self.worst = 0
 
     # Returns the upper-neck left motor position, in radians
     def get_upper_left(q) :
@@ -452,16 +589,6 @@ class Quaternion2Upper(MapperBase):
         if yaw-bad_yaw < -2:
             yaw += 3.14159265358979
 
-        if self.worst < abs(yaw-bad_yaw) :
-            self.worst = abs(yaw-bad_yaw)
-            print "worst: ", self.worst, self.worst * 180 / 3.14159
-
-        if 0.01 < yaw-bad_yaw or yaw-bad_yaw < -0.01:
-            print "Aieeeee! bad yaw!", yaw, bad_yaw, yaw-bad_yaw
-            exit
-        # print "Yaw: %9f" % bad_yaw, "%9.6f" % psi, "%9.6f" % phi,  \
-        #      "%9.6f" % twist, "%10.7f" % yaw, "delta %10.7f" % (yaw-bad_yaw)
-        # print "Yaw and approximation error", yaw, yaw-bad_yaw
         return yaw
 
     funcs = {
@@ -661,11 +788,57 @@ _mapper_classes = {
   "quaternion2dual": Quaternion2Dual
 }
 
-def build(yamlobj, motor_entry):
+# These keep per-call joint state (inverse_kinematics() followed by reading
+# theta_l/theta_r back), so every motor gets its own instance.
+_stateful_mappers = (Quaternion2Upper, Quaternion2Split, Quaternion2Dual)
+
+def _shareable(mapper):
+  if isinstance(mapper, Composite):
+    return all(_shareable(m) for m in mapper.mapper_list)
+  return not isinstance(mapper, _stateful_mappers)
+
+def _freeze(yamlobj):
+  if isinstance(yamlobj, dict):
+    return tuple(sorted((k, _freeze(v)) for k, v in yamlobj.items()))
+  elif isinstance(yamlobj, list):
+    return tuple(_freeze(v) for v in yamlobj)
+  # Keep the type, so that e.g. 1 and 1.0 (which divide differently) don't
+  # end up sharing a mapper.
+  return (type(yamlobj), yamlobj)
+
+def _build_key(yamlobj, motor_entry):
+  key = (_freeze(yamlobj),
+    _freeze(motor_entry.get('min')), _freeze(motor_entry.get('max')))
+  try:
+    hash(key)
+  except TypeError:
+    return None
+  return key
+
+def build(yamlobj, motor_entry, cache=None):
+  """
+  Build the mapper for the yaml 'function' entry 'yamlobj'.  If a 'cache'
+  dict is given, motors built with the same dict and an identical binding
+  and min/max share one mapper instance.  Callers should only share a
+  cache between motors that are driven from the same thread.
+  """
+  key = None
+  if cache is not None:
+    key = _build_key(yamlobj, motor_entry)
+    if key is not None and key in cache:
+      return cache[key]
+
   if isinstance(yamlobj, dict):
-    return _mapper_classes[yamlobj["name"]](yamlobj, motor_entry)
+    mapper = _mapper_classes[yamlobj["name"]](yamlobj, motor_entry)
 
   elif isinstance(yamlobj, list):
-    return Composite(
-      [build(func_entry, motor_entry) for func_entry in yamlobj]
+    mapper = Composite(
+      [build(func_entry, motor_entry, cache) for func_entry in yamlobj]
     )
+
+  else:
+    return None
+
+  if key is not None and _shareable(mapper):
+    cache[key] = mapper
+  return mapper
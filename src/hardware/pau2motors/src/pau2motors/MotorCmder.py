@@ -22,7 +22,7 @@ class MotorCmder:
   def _saturated(self, angle):
     return min(max(angle, self.motor_entry['min']), self.motor_entry['max'])  
 
-  def __init__(self, motor_entry):
+  def __init__(self, motor_entry, mapper_cache=None):
 
     binding_obj = motor_entry["pau"]
 
@@ -31,7 +31,8 @@ class MotorCmder:
     )
     self.mapper = MapperFactory.build(
       binding_obj["function"],
-      motor_entry
+      motor_entry,
+      mapper_cache
     )
     self.hardware = HardwareFactory.build(
         motor_entry
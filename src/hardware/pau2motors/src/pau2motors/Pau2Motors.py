@@ -8,10 +8,13 @@ class Pau2Motors:
 
   def __init__(self, motors_yaml):
     motor_commanders = []
+    # All these motors are driven from one subscriber, so they can share
+    # mappers with identical bindings.
+    mapper_cache = {}
 
     for motor_entry in motors_yaml:
       try:
-        motor_commanders.append(MotorCmder(motor_entry))
+        motor_commanders.append(MotorCmder(motor_entry, mapper_cache))
       except:
         print "Failed to create motor Entry {}".format(motor_entry)
     self.motor_commanders = motor_commanders
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+#
+# Unit tests for MapperFactory.  These don't need ROS; run directly with
+# python.
+#
+
+import unittest
+import os
+import sys
+import math
+import random
+import itertools
+import copy
+
+CWD = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(CWD, '../src/pau2motors'))
+import MapperFactory
+
+# The per-axis YZX formulas used by quaternion2euler before the switch to
+# _quat_to_euler, returned in extrinsic X-Z-Y order.
+def old_yzx(w, x, y, z):
+    return (
+        math.atan2(-2 * (y * z - w * x), w**2 + y**2 - z**2 - x**2),
+        math.asin(2 * (y * x + w * z)),
+        math.atan2(-2 * (z * x - w * y), w**2 - y**2 - z**2 + x**2))
+
+def qmul(p, q):
+    a1, b1, c1, d1 = p
+    a2, b2, c2, d2 = q
+    return (a1*a2 - b1*b2 - c1*c2 - d1*d2,
+            a1*b2 + b1*a2 + c1*d2 - d1*c2,
+            a1*c2 - b1*d2 + c1*a2 + d1*b2,
+            a1*d2 + b1*c2 - c1*b2 + d1*a2)
+
+def axis_quat(axis, angle):
+    q = [math.cos(angle / 2), 0.0, 0.0, 0.0]
+    q[axis] = math.sin(angle / 2)
+    return tuple(q)
+
+def compose(seq, angles):
+    """Quaternion for R = R_k(t3) R_j(t2) R_i(t1), seq = (i, j, k)."""
+    return qmul(axis_quat(seq[2], angles[2]),
+        qmul(axis_quat(seq[1], angles[1]), axis_quat(seq[0], angles[0])))
+
+def random_unit_quat(rng):
+    q = [rng.gauss(0, 1) for i in range(4)]
+    n = math.sqrt(sum(v * v for v in q))
+    return tuple(v / n for v in q)
+
+SEQUENCES = [s for s in itertools.product((1, 2, 3), repeat=3)
+    if s[0] != s[1] and s[1] != s[2]]
+
+class QuatToEulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(0)
+
+    def assertSameRotation(self, q, r):
+        # q and -q are the same rotation
+        err = min(sum((a - b)**2 for a, b in zip(q, r)),
+                  sum((a + b)**2 for a, b in zip(q, r)))
+        self.assertLess(err, 1e-12)
+
+    def test_matches_old_yzx_formulas(self):
+        for i in range(5000):
+            q = random_unit_quat(self.rng)
+            new = MapperFactory._quat_to_euler(
+                q[0], q[1], q[2], q[3], (1, 3, 2))
+            for a, b in zip(new, old_yzx(*q)):
+                self.assertAlmostEqual(a, b, places=12)
+
+    def test_unnormalized_middle_angle(self):
+        # The inputs of test_pau2motors.py
+        self.assertEqual(
+            MapperFactory._quat_to_euler(1.0, 0.5, 0.5, 0.0, (1, 3, 2))[1],
+            math.asin(0.5))
+        self.assertEqual(
+            MapperFactory._quat_to_euler(1.0, 1.0, 0.5, 0.0, (1, 3, 2))[1],
+            math.pi / 2)
+
+    def test_roundtrip_all_sequences(self):
+        for seq in SEQUENCES:
+            for i in range(500):
+                q = random_unit_quat(self.rng)
+                angles = MapperFactory._quat_to_euler(
+                    q[0], q[1], q[2], q[3], seq)
+                self.assertSameRotation(q, compose(seq, angles))
+
+    def test_gimbal_lock(self):
+        for seq in SEQUENCES:
+            if seq[0] == seq[2]:
+                locks = (0.0, math.pi)
+            else:
+                locks = (math.pi / 2, -math.pi / 2)
+            for middle in locks:
+                for i in range(50):
+                    q = compose(seq, (self.rng.uniform(-3, 3), middle,
+                        self.rng.uniform(-3, 3)))
+                    angles = MapperFactory._quat_to_euler(
+                        q[0], q[1], q[2], q[3], seq)
+                    self.assertEqual(angles[2], 0.0)
+                    self.assertSameRotation(q, compose(seq, angles))
+
+        angles = MapperFactory._quat_to_euler(0.5, 0.5, 0.5, 0.5, (1, 3, 2))
+        self.assertAlmostEqual(angles[0], math.pi / 2)
+        self.assertAlmostEqual(angles[1], math.pi / 2)
+        self.assertEqual(angles[2], 0.0)
+
+class Quat(object):
+    def __init__(self, w, x, y, z):
+        self.w = w
+        self.x = x
+        self.y = y
+        self.z = z
+
+class Quaternion2EulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(0)
+
+    def test_default_matches_old_yzx_formulas(self):
+        mappers = [MapperFactory.Quaternion2EulerYZX({'axis': axis}, {})
+            for axis in ('x', 'z', 'y')]
+        for i in range(1000):
+            q = random_unit_quat(self.rng)
+            for mapper, expect in zip(mappers, old_yzx(*q)):
+                self.assertAlmostEqual(mapper.map(Quat(*q)), expect, places=12)
+
+    def test_default_unnormalized(self):
+        mapper = MapperFactory.Quaternion2EulerYZX({'axis': 'z'}, {})
+        # The inputs of test_pau2motors.py
+        self.assertEqual(mapper.map(Quat(1.0, 0.5, 0.5, 0.0)), math.asin(0.5))
+        self.assertEqual(mapper.map(Quat(1.0, 1.0, 0.5, 0.0)), math.pi / 2)
+        # Like the old formula, asin is out of its domain here
+        self.assertRaises(ValueError, mapper.map, Quat(1.0, 1.0, 1.0, 0.0))
+
+    def test_sequence(self):
+        mapper = MapperFactory.Quaternion2EulerYZX(
+            {'sequence': 'zyz', 'index': 2}, {})
+        for i in range(100):
+            q = random_unit_quat(self.rng)
+            self.assertEqual(mapper.map(Quat(*q)),
+                MapperFactory._quat_to_euler(q[0], q[1], q[2], q[3], (3, 2, 3))[2])
+
+class WeightedSumTest(unittest.TestCase):
+
+    ARGS = {
+        'name': 'weightedsum',
+        'imin': 0.402,
+        'terms': [
+            {'min': 0, 'max': 1, 'imax': 0},
+            {'min': 0.6, 'max': 0, 'imax': 1},
+        ]
+    }
+    MOTOR = {'min': -0.5, 'max': 0.7}
+
+    def old_map(self, mapper, vals):
+        # The formula WeightedSum.map used before the per-term precomputation
+        def saturated(val, term):
+            return min(max(val, min(term['min'], term['max'])),
+                max(term['min'], term['max']))
+        return sum(
+            (saturated(val, term) + translate) * scale
+            for val, translate, scale, term in zip(vals,
+                mapper.pretranslations, mapper.scalefactors, mapper.termargs)
+        ) + mapper.posttranslate
+
+    def test_matches_old_formula(self):
+        mapper = MapperFactory.WeightedSum(self.ARGS, self.MOTOR)
+        for vals in ([0.2, 0.3], [-1.0, 2.0], [1.5, -0.2], [0.5, 0.4]):
+            self.assertAlmostEqual(mapper.map(vals), self.old_map(mapper, vals))
+
+    def test_mismatched_length(self):
+        mapper = MapperFactory.WeightedSum(self.ARGS, self.MOTOR)
+        for vals in ([0.2], [0.2, 0.3, 0.9], []):
+            self.assertAlmostEqual(mapper.map(vals), self.old_map(mapper, vals))
+
+class InterpSumTest(unittest.TestCase):
+
+    ARGS = {
+        'name': 'interpsum',
+        'y0': 0.4,
+        'terms': [
+            {'x0': 0, 'points': [[1, 0]]},
+            {'x0': 0, 'points': [[0.6, 0.2], [0.8, 0.0]]},
+            {'x0': 0.5, 'points': [[0.6, 0.6], [0.7, 0.8], [0.9, 1]]},
+        ]
+    }
+    MOTOR = {'min': -1.0, 'max': 2.0}
+
+    def old_map(self, mapper, vals):
+        # The formula InterpSum.map used before its offset was folded
+        def saturated(val, term):
+            return min(max(val, min(term['x0'], term['xmax'])),
+                max(term['x0'], term['xmax']))
+        return (sum(
+            function(saturated(val, term)) - mapper.y0
+            for val, function, term in zip(vals, mapper.functions, mapper.termargs)
+        ) + mapper.y0) * mapper.range + mapper.motor_min
+
+    def test_matches_old_formula(self):
+        mapper = MapperFactory.InterpSum(copy.deepcopy(self.ARGS), self.MOTOR)
+        for vals in ([0.3, 0.5, 0.8], [-1.0, 2.0, 0.0], [0.5], [0.5, 0.7], []):
+            self.assertAlmostEqual(mapper.map(vals), self.old_map(mapper, vals))
+
+class CountingMapper(MapperFactory.MapperBase):
+    def __init__(self):
+        self.calls = 0
+
+    def map(self, val):
+        self.calls += 1
+        return val * 2
+
+class CompositeTest(unittest.TestCase):
+
+    def test_repeated_input_is_cached(self):
+        child = CountingMapper()
+        composite = MapperFactory.Composite([child])
+        self.assertEqual(composite.map(1.5), 3.0)
+        self.assertEqual(composite.map(1.5), 3.0)
+        self.assertEqual(child.calls, 1)
+        self.assertEqual(composite.map(2.0), 4.0)
+        self.assertEqual(child.calls, 2)
+        self.assertEqual(composite.map(1.5), 3.0)
+        self.assertEqual(child.calls, 3)
+
+    def test_equal_list_input_is_cached(self):
+        child = CountingMapper()
+        composite = MapperFactory.Composite([child])
+        self.assertEqual(composite.map([1]), [1, 1])
+        self.assertEqual(composite.map([1]), [1, 1])
+        self.assertEqual(child.calls, 1)
+
+class BuildCacheTest(unittest.TestCase):
+
+    LINEAR = [{'name': 'linear', 'scale': -2.92, 'translate': 0}]
+    MOTOR = {'min': -1.0, 'max': 1.0}
+
+    def test_identical_bindings_share(self):
+        cache = {}
+        a = MapperFactory.build(copy.deepcopy(self.LINEAR), self.MOTOR, cache)
+        b = MapperFactory.build(copy.deepcopy(self.LINEAR), self.MOTOR, cache)
+        self.assertIs(a, b)
+
+    def test_no_cache_no_sharing(self):
+        a = MapperFactory.build(copy.deepcopy(self.LINEAR), self.MOTOR)
+        b = MapperFactory.build(copy.deepcopy(self.LINEAR), self.MOTOR)
+        self.assertIsNot(a, b)
+
+    def test_separate_caches_dont_share(self):
+        a = MapperFactory.build(copy.deepcopy(self.LINEAR), self.MOTOR, {})
+        b = MapperFactory.build(copy.deepcopy(self.LINEAR), self.MOTOR, {})
+        self.assertIsNot(a, b)
+
+    def test_motor_range_is_part_of_key(self):
+        cache = {}
+        binding = [{'name': 'linear', 'min': 0.0, 'max': 1.0}]
+        a = MapperFactory.build(copy.deepcopy(binding), self.MOTOR, cache)
+        b = MapperFactory.build(copy.deepcopy(binding),
+            {'min': 0.0, 'max': 2.0}, cache)
+        self.assertIsNot(a, b)
+        self.assertNotEqual(a.map(0.5), b.map(0.5))
+
+    def test_int_and_float_args_dont_share(self):
+        cache = {}
+        a = MapperFactory.build({'name': 'linear', 'scale': 1, 'translate': 0},
+            self.MOTOR, cache)
+        b = MapperFactory.build({'name': 'linear', 'scale': 1.0, 'translate': 0},
+            self.MOTOR, cache)
+        self.assertIsNot(a, b)
+
+    def test_stateful_mappers_not_shared(self):
+        cache = {}
+        binding = [{'name': 'quaternion2upper', 'axis': 'upleft'}]
+        a = MapperFactory.build(copy.deepcopy(binding), self.MOTOR, cache)
+        b = MapperFactory.build(copy.deepcopy(binding), self.MOTOR, cache)
+        self.assertIsNot(a, b)
+        self.assertIsNot(a.mapper_list[0], b.mapper_list[0])
+
+if __name__ == '__main__':
+    unittest.main()